@@ -0,0 +1,100 @@
+"""
+Request rate of LocalServer against local keep-alive pollers.
+
+Serves a fixed snapshot from a stand-in MQTTHandler and runs CLIENTS
+concurrent pollers hammering /readings.bin (and /readings), reporting
+requests per second.
+
+Runs on the host: python3 bench_local_server.py
+"""
+
+import sys
+import time
+import struct
+import socket
+import threading
+
+if sys.implementation.name != "micropython":
+    # Map the MicroPython module names and ticks functions onto CPython
+    import json
+    import select
+
+    sys.modules.update(ujson=json, ustruct=struct, usocket=socket, uselect=select)
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_diff = lambda a, b: a - b
+
+from local_server import LocalServer, READINGS_FORMAT
+
+PORT = 18080
+CLIENTS = 3
+REQUESTS = 3000
+
+
+class SnapshotHandler:
+    """Only the parts of MQTTHandler the server reads."""
+    def __init__(self):
+        self.metrics = {"steps": 42, "publishes": 42, "publish_errors": 0}
+        self.snapshot = {
+            "device": {"client": "WatqClient", "uptime": 123456, "hardware": "esp32", "firmware": "1.20.0"},
+            "sensors": {"temperature": 71.3, "turbidity": 1800, "tds": 900, "ph": 2000},
+            "led": {"onboard": 0},
+            "sampling": {"mode": "idle", "interval": 60},
+        }
+
+
+def get(sock, path):
+    sock.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: watq\r\n\r\n")
+    buf = b""
+    while b"\r\n\r\n" not in buf:
+        buf += sock.recv(4096)
+    head, body = buf.split(b"\r\n\r\n", 1)
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    while len(body) < length:
+        body += sock.recv(4096)
+    return head.split(b"\r\n")[0], body
+
+
+def poller(path, done):
+    sock = socket.create_connection(("127.0.0.1", PORT))
+    for _ in range(REQUESTS):
+        status, _ = get(sock, path)
+        assert status == b"HTTP/1.1 200 OK", status
+    sock.close()
+    done.append(REQUESTS)
+
+
+def bench(path):
+    done = []
+    threads = [threading.Thread(target=poller, args=(path, done)) for _ in range(CLIENTS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    assert len(done) == CLIENTS, "a poller failed"
+    print("%s: %d keep-alive pollers, %.0f req/s" % (path.decode(), CLIENTS, sum(done) / elapsed))
+
+
+def main():
+    server = LocalServer(SnapshotHandler(), port=PORT, max_clients=CLIENTS + 1)
+    running = [True]
+
+    def serve():
+        while running[0]:
+            server.poll(50)
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    sock = socket.create_connection(("127.0.0.1", PORT))
+    _, body = get(sock, b"/readings.bin")
+    print("readings.bin:", struct.unpack(READINGS_FORMAT, body))
+    sock.close()
+
+    bench(b"/readings.bin")
+    bench(b"/readings")
+    running[0] = False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Bytes on the wire per shadow update publish, MQTT 3.1.1 vs MQTT 5 with
+topic aliases, against an in-memory broker stand-in. Also exercises the
+MQTT 5 CONNACK, Receive Maximum flow control, PUBACK reason codes,
+inbound topic aliases and SUBACK handling.
+
+Runs on the device or on the host: python3 bench_mqtt5.py
+"""
+
+try:
+    import usocket
+except ImportError:  # CPython: map the MicroPython module names onto the stdlib
+    import sys
+    import socket
+    import struct
+    import binascii
+
+    sys.modules.update(usocket=socket, ustruct=struct, ubinascii=binascii)
+
+import umqttsimple as mqtt
+
+TOPIC = "$aws/things/WatqThing/shadow/update"
+PAYLOAD = b'{"state": {"reported": {"sensors": {"temperature": 71.3, "turbidity": 1800, "tds": 900, "ph": 2000}}}}'
+
+
+class BrokerSocket:
+    """Socket stand-in: reads come from the scripted broker replies, writes are captured."""
+    def __init__(self, replies=b""):
+        self.rx = bytearray(replies)
+        self.tx = bytearray()
+
+    def feed(self, replies):
+        self.rx += replies
+
+    def write(self, data, n=None):
+        if isinstance(data, str):
+            data = data.encode()
+        self.tx += data[:n] if n is not None else data
+
+    def read(self, n):
+        data = bytes(self.rx[:n])
+        self.rx = self.rx[n:]
+        return data
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        pass
+
+
+def connack5(props):
+    body = b"\0\0" + mqtt._enc_props(props)
+    return b"\x20" + mqtt._enc_varint(len(body)) + body
+
+
+def client(protocol, replies=b""):
+    c = mqtt.MQTTClient("WatqClient", "broker", protocol=protocol)
+    c.sock = BrokerSocket(replies)
+    return c
+
+
+def publish_size(c, **kwargs):
+    c.sock.tx = bytearray()
+    c.publish(TOPIC, PAYLOAD, **kwargs)
+    return len(c.sock.tx)
+
+
+def main():
+    v4 = client(4)
+    size_v4 = publish_size(v4)
+
+    # A 3.1.1-only broker rejects the MQTT 5 CONNECT with a 2 byte CONNACK
+    try:
+        client(5, b"\x20\x02\x00\x01")._connect5(True)
+        assert 0, "expected MQTTException"
+    except mqtt.MQTTException as e:
+        assert e.args[0] == 1
+
+    v5 = client(5, connack5({mqtt.PROP_TOPIC_ALIAS_MAXIMUM: 10, mqtt.PROP_RECEIVE_MAXIMUM: 2}))
+    v5._connect5(True)
+    assert v5.topic_alias_max == 10 and v5.recv_max == 2
+    first = publish_size(v5)
+    later = publish_size(v5)
+    expiry = publish_size(v5, properties={mqtt.PROP_MESSAGE_EXPIRY: 300})
+
+    print("payload bytes:", len(PAYLOAD))
+    print("MQTT 3.1.1 bytes/publish:", size_v4)
+    print("MQTT 5 first publish (alias assigned):", first)
+    print("MQTT 5 later publishes (alias only):", later)
+    print("MQTT 5 with message expiry:", expiry)
+    print("saved per publish: %d bytes (%.0f%%)" % (size_v4 - later, 100 * (size_v4 - later) / size_v4))
+
+    # Receive Maximum 2: the third QoS 1 publish waits for the first PUBACK
+    v5.sock.feed(b"\x40\x02\x00\x01")
+    for _ in range(3):
+        v5.publish(TOPIC, PAYLOAD, qos=1)
+    assert v5._inflight == {2, 3}, v5._inflight
+
+    # PUBACK reason code 0x87 (not authorized) is raised by flush()
+    v5.sock.feed(b"\x40\x02\x00\x02" + b"\x40\x03\x00\x03\x87")
+    try:
+        v5.flush()
+        assert 0, "expected MQTTException"
+    except mqtt.MQTTException as e:
+        assert e.args[0] == 0x87
+
+    # Inbound topic alias: the second message carries only the alias
+    got = []
+    v5.set_callback(lambda topic, msg: got.append((topic, msg)))
+    for topic, msg in (("watq/cmd", b"a"), ("", b"b")):
+        body = mqtt._enc_str(topic) + mqtt._enc_props({mqtt.PROP_TOPIC_ALIAS: 1}) + msg
+        v5.sock.feed(b"\x30" + mqtt._enc_varint(len(body)) + body)
+        v5.wait_msg()
+    assert got == [(b"watq/cmd", b"a"), (b"watq/cmd", b"b")], got
+
+    # SUBACK with a success reason code
+    v5.pid = 4
+    v5.sock.feed(b"\x90\x04\x00\x05\x00\x00")
+    v5.subscribe("watq/cmd")
+    print("MQTT 5 broker stand-in checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Per-sample cost of ChangeDetector and AdaptiveSampler, to check the change
+detection fits the sampling budget. It also reports the idle/burst
+transitions for a simulated turbidity spike.
+
+Run on the device: ampy --port COM6 run bench_sampler.py
+"""
+
+import time
+import random
+from main import ChangeDetector, AdaptiveSampler
+
+SAMPLES = 2000
+STREAMS = ("temperature", "turbidity", "tds", "ph")
+
+
+def per_sample_us(fn, n=SAMPLES):
+    start = time.ticks_us()
+    for i in range(n):
+        fn(i)
+    return time.ticks_diff(time.ticks_us(), start) / n
+
+
+def main():
+    detector = ChangeDetector()
+    us = per_sample_us(lambda i: detector.update(1800 + random.getrandbits(3)))
+    print("ChangeDetector.update: %.1f us/sample" % us)
+
+    sampler = AdaptiveSampler({name: ChangeDetector(min_std=5) for name in STREAMS})
+    readings = {"temperature": 70.0, "turbidity": 1800, "tds": 900, "ph": 2000}
+    us = per_sample_us(lambda i: sampler.update(readings))
+    print("AdaptiveSampler.update (%d streams): %.1f us/sample" % (len(STREAMS), us))
+
+    # Idle noise, then a 20 sample turbidity spike
+    sampler = AdaptiveSampler({"turbidity": ChangeDetector(min_std=5)})
+    for i in range(200):
+        spike = 500 if 100 <= i < 120 else 0
+        mode = sampler.update({"turbidity": 1800 + random.getrandbits(3) + spike})
+        if mode:
+            print("sample %d: %s (interval %d s)" % (i, mode, sampler.interval))
+
+
+if __name__ == "__main__":
+    main()
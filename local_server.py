@@ -0,0 +1,233 @@
+"""
+Non-blocking HTTP endpoint serving the latest readings on the local network.
+
+    GET /readings      latest reported state as JSON
+    GET /readings.bin  the same readings packed as READINGS_FORMAT
+    GET /metrics       MQTTHandler and server counters as JSON
+
+Connections are kept alive for HTTP/1.1 clients so pollers can reuse them,
+and dropped after idle_timeout ms without traffic.
+MQTTHandler.run() services the server while it sleeps between steps, so
+polls are answered with at most one sensor read of latency.
+"""
+
+import time
+import ujson
+import ustruct as struct
+import usocket as socket
+import uselect as select
+
+# step count, uptime ms, temperature F (NaN if missing), turbidity, pH, TDS
+# (raw ADC, 0xFFFF if missing or out of range), sampling mode (0 idle, 1 burst, 0xFF without a sampler)
+READINGS_FORMAT = "<IIfHHHB"
+_MODES = {"idle": 0, "burst": 1}
+_MAX_REQUEST = 1024
+_MISSING = 0xFFFF
+_BAD_REQUEST = b'HTTP/1.0 400 Bad Request\r\nContent-Type: application/json\r\nContent-Length: 25\r\nConnection: close\r\n\r\n{"error": "bad request"}\n'
+
+
+class LocalServer:
+    def __init__(self, handler, port=8080, max_clients=4, idle_timeout=30000):
+        self.handler = handler
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout  # ms without traffic before a client is dropped
+        self.requests = 0
+        self.clients = {}  # socket -> [request buffer, response buffer, close when sent, last activity ms]
+        self.fds = {}  # fileno -> socket, for ports whose poll() reports file numbers
+        self._cached = None
+        self._json = b""
+        self._bin = b""
+
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(socket.getaddrinfo("0.0.0.0", port)[0][-1])
+        self.sock.listen(max_clients)
+        self.sock.setblocking(False)
+        self.poller = select.poll()
+        self._register(self.sock)
+
+    def _register(self, sock):
+        if hasattr(sock, "fileno"):
+            self.fds[sock.fileno()] = sock
+        self.poller.register(sock, select.POLLIN)
+
+    def _close(self, sock):
+        self.poller.unregister(sock)
+        if hasattr(sock, "fileno"):
+            self.fds.pop(sock.fileno(), None)
+        self.clients.pop(sock, None)
+        sock.close()
+
+    def serve(self, ms):
+        """Answer requests for ms milliseconds."""
+        start = time.ticks_ms()
+        remaining = ms
+        while remaining > 0:
+            self.poll(remaining)
+            remaining = ms - time.ticks_diff(time.ticks_ms(), start)
+
+    def poll(self, timeout=0):
+        """Handle whatever sockets are ready within timeout milliseconds."""
+        for obj, event in self.poller.poll(timeout):
+            sock = self.fds.get(obj, obj)
+            if sock is self.sock:
+                self._accept()
+            elif event & (select.POLLHUP | select.POLLERR):
+                self._close(sock)
+            else:
+                # One client's broken connection or request must never
+                # reach MQTTHandler.run()
+                try:
+                    if event & select.POLLIN:
+                        self._read(sock)
+                    if event & select.POLLOUT and sock in self.clients:
+                        self._write(sock)
+                except OSError:
+                    self._close(sock)
+                except Exception:
+                    self._fail(sock)
+
+        # Drop idle keep-alive clients and half-open connections so they
+        # cannot hold the max_clients slots for good
+        now = time.ticks_ms()
+        for sock, state in list(self.clients.items()):
+            if time.ticks_diff(now, state[3]) > self.idle_timeout:
+                self._close(sock)
+
+    def _fail(self, sock):
+        try:
+            sock.send(_BAD_REQUEST)
+        except Exception:
+            pass
+        self._close(sock)
+
+    def _accept(self):
+        try:
+            client, _ = self.sock.accept()
+        except OSError:
+            return
+        if len(self.clients) >= self.max_clients:
+            client.close()
+            return
+        client.setblocking(False)
+        self.clients[client] = [b"", b"", False, time.ticks_ms()]
+        self._register(client)
+
+    def _read(self, sock):
+        data = sock.recv(512)
+        if not data:
+            self._close(sock)
+            return
+        state = self.clients[sock]
+        state[3] = time.ticks_ms()
+        state[0] += data
+        while not state[2] and b"\r\n\r\n" in state[0]:
+            request, state[0] = state[0].split(b"\r\n\r\n", 1)
+            state[1] += self._respond(request, state)
+        if not state[2] and len(state[0]) > _MAX_REQUEST:
+            self._close(sock)
+            return
+        if state[1]:
+            self.poller.modify(sock, select.POLLIN | select.POLLOUT)
+
+    def _write(self, sock):
+        state = self.clients[sock]
+        state[3] = time.ticks_ms()
+        sent = sock.send(state[1])
+        state[1] = state[1][sent:]
+        if not state[1]:
+            if state[2]:
+                self._close(sock)
+            else:
+                self.poller.modify(sock, select.POLLIN)
+
+    def _respond(self, request, state):
+        self.requests += 1
+        lines = request.split(b"\r\n")
+        parts = lines[0].split(b" ")
+        if len(parts) != 3 or parts[0] != b"GET" or parts[2] not in (b"HTTP/1.0", b"HTTP/1.1"):
+            state[2] = True
+            return _BAD_REQUEST
+        headers = b"\r\n".join(lines[1:]).lower()
+        if parts[2] == b"HTTP/1.1":
+            version = "HTTP/1.1"
+            state[2] = b"connection: close" in headers
+        else:
+            version = "HTTP/1.0"
+            state[2] = b"connection: keep-alive" not in headers
+
+        path = parts[1]
+        content_type = "application/json"
+        status = "200 OK"
+        try:
+            if path in (b"/", b"/readings"):
+                body = self._encoded()[0]
+            elif path == b"/readings.bin":
+                body = self._encoded()[1]
+                content_type = "application/octet-stream"
+            elif path == b"/metrics":
+                body = ujson.dumps(self.metrics()).encode()
+            else:
+                body = b'{"error": "not found"}'
+                status = "404 Not Found"
+        except Exception:
+            body = b'{"error": "cannot encode readings"}'
+            content_type = "application/json"
+            status = "500 Internal Server Error"
+        if not body:
+            body = b'{"error": "no readings yet"}'
+            content_type = "application/json"
+            status = "503 Service Unavailable"
+
+        header = f"{version} {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        if state[2]:
+            header += "Connection: close\r\n"
+        elif version == "HTTP/1.0":
+            # HTTP/1.0 clients close unless keep-alive is confirmed
+            header += "Connection: keep-alive\r\n"
+        return header.encode() + b"\r\n" + body
+
+    def _encoded(self):
+        # Encode each snapshot once, however many pollers ask for it
+        snapshot = self.handler.snapshot
+        if snapshot is not self._cached:
+            json = ujson.dumps(snapshot).encode() if snapshot else b""
+            packed = self.pack(snapshot) if snapshot else b""
+            self._cached, self._json, self._bin = snapshot, json, packed
+        return self._json, self._bin
+
+    def pack(self, reported):
+        sensors = reported.get("sensors", {})
+        sampling = reported.get("sampling")
+        return struct.pack(
+            READINGS_FORMAT,
+            _uint32(self.handler.metrics["steps"]),
+            _uint32(reported.get("device", {}).get("uptime")),
+            _temperature(sensors.get("temperature")),
+            *[_adc(sensors.get(k)) for k in ("turbidity", "ph", "tds")],
+            _MODES.get(sampling.get("mode"), 0xFF) if sampling else 0xFF
+        )
+
+    def metrics(self):
+        metrics = dict(self.handler.metrics)
+        metrics["requests"] = self.requests
+        metrics["clients"] = len(self.clients)
+        return metrics
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _uint32(value):
+    return int(value) & 0xFFFFFFFF if _is_number(value) else 0
+
+
+def _temperature(value):
+    return float(value) if _is_number(value) else float("nan")
+
+
+def _adc(value):
+    if _is_number(value) and 0 <= value < _MISSING:
+        return int(value)
+    return _MISSING
@@ -6,6 +6,7 @@ from machine import Pin, ADC
 import array
 import socket
 import json
+from ubinascii import hexlify
 from temp_sensor import DS18X20
 from onewire import OneWire
 import config
@@ -91,6 +92,30 @@ class TemperatureSensor(Sensor):
             temperatures.append(temp_f)
         return temperatures
 
+class MultiBusTemperatureSensor(Sensor):
+    """DS18X20 probes spread over several OneWire buses (one per pin).
+
+    Conversions are started on every bus before the single wait, so a read
+    takes one conversion time however many buses there are. Readings are
+    returned as (pin, rom_hex, temp_f) tuples.
+    """
+    def __init__(self, pins):
+        self.buses = []
+        for pin in pins:
+            temp_sensor = DS18X20(OneWire(Pin(pin)))
+            self.buses.append((pin, temp_sensor, temp_sensor.scan()))
+
+    def read(self):
+        for _, temp_sensor, _ in self.buses:
+            temp_sensor.convert_temp()
+        time.sleep(1)
+        readings = []
+        for pin, temp_sensor, roms in self.buses:
+            for rom in roms:
+                temp_f = temp_sensor.fahrenheit(temp_sensor.read_temp(rom))
+                readings.append((pin, hexlify(rom).decode(), temp_f))
+        return readings
+
 class TurbiditySensor(Sensor):
     def __init__(self, pin):
         self.turbidity_sensor = ADC(Pin(pin))
@@ -155,8 +180,106 @@ class TDSSensor(Sensor):
 #         return median
         
 
+class ChangeDetector:
+    """EWMA mean/variance of one sensor stream.
+
+    score() rates a sample as a z-score against the baseline, update() does
+    the same and then folds the sample in. min_std keeps flat (e.g.
+    quantised ADC) streams from scoring every small step as a huge change.
+    """
+    def __init__(self, alpha=0.1, min_std=1.0, warmup=5):
+        self.alpha = alpha
+        self.min_std = min_std
+        self.warmup = warmup
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+
+    def score(self, x):
+        if self.count == 0 or self.count < self.warmup:
+            return 0.0
+        return (x - self.mean) / max(self.var ** 0.5, self.min_std)
+
+    def update(self, x):
+        if self.count == 0:
+            self.mean = x
+            self.count = 1
+            return 0.0
+        z = self.score(x)
+        diff = x - self.mean
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+        return z
+
+    def rebase(self, x):
+        """Accept x as the new level, keeping the noise estimate."""
+        self.mean = x
+
+class AdaptiveSampler:
+    """Switches between a slow idle rate and a fast burst rate.
+
+    A burst starts when any stream's |z| reaches enter_z, and ends once every
+    stream has stayed below exit_z for calm_samples samples in a row, or
+    after max_burst seconds, whichever comes first. The detectors' baselines
+    are frozen during a burst, so a sustained change keeps scoring against
+    the pre-burst level instead of absorbing itself. A burst cut short by
+    max_burst takes the current readings as the new level.
+    """
+    IDLE = "idle"
+    BURST = "burst"
+
+    def __init__(self, detectors, idle_interval=60, burst_interval=2, enter_z=4.0, exit_z=2.0, calm_samples=5, max_burst=300):
+        self.detectors = detectors
+        self.idle_interval = idle_interval
+        self.burst_interval = burst_interval
+        self.enter_z = enter_z
+        self.exit_z = exit_z
+        self.calm_samples = calm_samples
+        self.max_burst = max_burst
+
+        self.mode = self.IDLE
+        self.calm = 0
+        self.burst_start = 0
+
+    @property
+    def interval(self):
+        return self.burst_interval if self.mode == self.BURST else self.idle_interval
+
+    def update(self, readings):
+        """Feed one sample per stream, returns the new mode on a transition, else None."""
+        samples = []
+        z_max = 0.0
+        for name, value in readings.items():
+            detector = self.detectors.get(name)
+            if detector is not None and value is not None:
+                samples.append((detector, value))
+                z_max = max(z_max, abs(detector.score(value)))
+
+        if self.mode == self.IDLE:
+            if z_max >= self.enter_z:
+                self.mode = self.BURST
+                self.calm = 0
+                self.burst_start = time.ticks_ms()
+                return self.mode
+            for detector, value in samples:
+                detector.update(value)
+            return None
+
+        self.calm = self.calm + 1 if z_max < self.exit_z else 0
+        if self.calm >= self.calm_samples:
+            self.mode = self.IDLE
+            return self.mode
+        if time.ticks_diff(time.ticks_ms(), self.burst_start) >= self.max_burst * 1000:
+            for detector, value in samples:
+                detector.rebase(value)
+            self.mode = self.IDLE
+            return self.mode
+        return None
+
 class MQTTHandler:
-    def __init__(self, client_id, endpoint, key_path, cert_path, thing_name, temp_sensor, turbidity_sensor, ph_sensor, led_pin=2):
+    def __init__(self, client_id, endpoint, key_path, cert_path, thing_name, temp_sensor, turbidity_sensor, ph_sensor, led_pin=2, protocol=4, sampler=None, tds_sensor=None):
         self.client_id = client_id
         self.endpoint = endpoint
 
@@ -171,15 +294,23 @@ class MQTTHandler:
         self.temp_sensor = temp_sensor
         self.turbidity_sensor = turbidity_sensor
         self.ph_sensor = ph_sensor
+        self.tds_sensor = tds_sensor
+        self.sampler = sampler  # AdaptiveSampler, fixed 10 s interval if None
+        self.server = None  # LocalServer, serviced while sleeping between steps
+
+        # Latest reported state and counters, shared with the local server
+        self.snapshot = None
+        self.metrics = {"steps": 0, "publishes": 0, "publish_errors": 0}
 
         self.info = os.uname()
+        self.protocol = protocol  # 5 enables MQTT 5 topic aliases
 
     def connect(self):
         ssl_params = {
             'key': self.key_path,
             'cert': self.cert_path,
         }
-        self.mqtt = MQTTClient(self.client_id, self.endpoint, port=8883, ssl=True, ssl_params=ssl_params)
+        self.mqtt = MQTTClient(self.client_id, self.endpoint, port=8883, ssl=True, ssl_params=ssl_params, protocol=self.protocol)
         print("Connecting to AWS IoT...")
         self.mqtt.connect()
         print("Connected")
@@ -202,47 +333,76 @@ class MQTTHandler:
     def led_state(self, message):
         self.led.value(message['state']['led']['onboard'])
 
-    def run(self):
-        while True:
-            try:
-                self.mqtt.check_msg()
-            except:
-                print("Unable to check for messages.")
-
-            temperatures = self.temp_sensor.read()
-            turbidity = self.turbidity_sensor.read()
-            ph = self.ph_sensor.read()
-            tds = self.tds_sensor.read()
-
-            mesg = ujson.dumps({
-                "state": {
-                    "reported": {
-                        "device": {
-                            "client": self.client_id,
-                            "uptime": time.ticks_ms(),
-                            "hardware": self.info[0],
-                            "firmware": self.info[2]
-                        },
-                        "sensors": {
-                            "temperature": temperatures[0],
-                            "turbidity": turbidity,
-                            "tds": tds,
-                            "ph": ph
-                        },
-                        "led": {
-                            "onboard": self.led.value()
-                        }
-                    }
-                }
-            })
+    def step(self):
+        """Check for messages, read every sensor and publish once, returns the seconds to sleep."""
+        try:
+            self.mqtt.check_msg()
+        except:
+            print("Unable to check for messages.")
+
+        temperatures = self.temp_sensor.read()
+        turbidity = self.turbidity_sensor.read()
+        ph = self.ph_sensor.read()
+        tds = self.tds_sensor.read() if self.tds_sensor else None
+
+        probes = None
+        if temperatures and isinstance(temperatures[0], tuple):
+            # MultiBusTemperatureSensor: report every probe, keyed "<pin>/<rom>"
+            probes = {f"{pin}/{rom}": temp_f for pin, rom, temp_f in temperatures}
+            temperatures = [temp_f for _, _, temp_f in temperatures]
+        readings = {
+            "temperature": temperatures[0],
+            "turbidity": turbidity,
+            "tds": tds,
+            "ph": ph
+        }
 
-            try:
-                self.mqtt_publish(message=mesg)
-            except:
-                print("Unable to publish message.")
+        reported = {
+            "device": {
+                "client": self.client_id,
+                "uptime": time.ticks_ms(),
+                "hardware": self.info[0],
+                "firmware": self.info[2]
+            },
+            "sensors": dict(readings),
+            "led": {
+                "onboard": self.led.value()
+            }
+        }
+        if probes is not None:
+            reported["sensors"]["temperatures"] = probes
+            # Probes can also get their own detectors, keyed "<pin>/<rom>"
+            readings.update(probes)
+
+        interval = 10
+        if self.sampler:
+            mode = self.sampler.update(readings)
+            if mode:
+                print(f"Sampling mode changed to {mode}")
+            interval = self.sampler.interval
+            reported["sampling"] = {"mode": self.sampler.mode, "interval": interval}
+
+        self.snapshot = reported
+        self.metrics["steps"] += 1
+        mesg = ujson.dumps({"state": {"reported": reported}})
+
+        try:
+            self.mqtt_publish(message=mesg)
+            self.metrics["publishes"] += 1
+        except:
+            self.metrics["publish_errors"] += 1
+            print("Unable to publish message.")
+
+        return interval
 
-            print("Sleep for 10 seconds")
-            time.sleep(10)
+    def run(self):
+        while True:
+            interval = self.step()
+            print(f"Sleep for {interval} seconds")
+            if self.server:
+                self.server.serve(interval * 1000)
+            else:
+                time.sleep(interval)
 
 def main():
     wifi = WiFiConnection(config.SSID, config.PASS)
@@ -271,9 +431,18 @@ def main():
     #     thing_name="WatqThing",
     #     temp_sensor=temp_sensor,
     #     turbidity_sensor=turbidity_sensor,
-    #     ph_sensor=ph_sensor
+    #     ph_sensor=ph_sensor,
+    #     tds_sensor=tds_sensor,
+    #     sampler=AdaptiveSampler({
+    #         "turbidity": ChangeDetector(min_std=5),
+    #         "ph": ChangeDetector(min_std=5),
+    #         "tds": ChangeDetector(min_std=5),
+    #     })
     # )
 
+    # from local_server import LocalServer
+    # mqtt_handler.server = LocalServer(mqtt_handler, port=8080)
+
     # mqtt_handler.connect()
     # mqtt_handler.run()
 
@@ -0,0 +1,280 @@
+"""
+Record raw sensor traces to a compact binary file and replay them through
+the sensor classes and MQTTHandler under a virtual clock.
+
+File layout: the magic b"WQTR\x02" followed by records of
+    <uint32 ms since start, wrapping> <uint8 channel> <uint8 length> <payload>
+Channel 0 declares the next free channel id (1, 2, ...) with the channel
+name as its payload. ADC channels store the raw count as a uint16, DS18X20
+channels store a status byte (1 if the read failed its CRC check), the
+8 byte ROM and the 9 byte scratchpad, and
+"<name>.roms" holds the ROMs found by the initial scan.
+
+Records are replayed in the order they were written, so the replayed
+pipeline must read its sensors in the same order as the recorded one.
+"""
+
+import time
+import ustruct as struct
+import main
+from temp_sensor import DS18X20
+
+MAGIC = b"WQTR\x02"
+_HEADER = "<IBB"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_ADC_ATTRS = ("turbidity_sensor", "ph_sensor", "tds_sensor")
+
+
+class TraceMismatch(Exception):
+    """The replayed pipeline asked for a different record than the trace holds next."""
+    pass
+
+
+class TraceWriter:
+    def __init__(self, f):
+        self.f = f
+        self.channels = {}
+        self.last = time.ticks_ms()
+        self.elapsed = 0
+        f.write(MAGIC)
+
+    def _record(self, channel, payload):
+        # ticks_ms wraps (2**30 ms on the ESP32), so accumulate the short
+        # differences between records instead of diffing against the start
+        now = time.ticks_ms()
+        self.elapsed += time.ticks_diff(now, self.last)
+        self.last = now
+        t = self.elapsed & 0xFFFFFFFF
+        self.f.write(struct.pack(_HEADER, t, channel, len(payload)))
+        self.f.write(payload)
+
+    def write(self, name, payload):
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = len(self.channels) + 1
+            self.channels[name] = channel
+            self._record(0, name.encode())
+        self._record(channel, payload)
+
+
+class TraceReader:
+    def __init__(self, f):
+        self.f = f
+        self.channels = {}
+        self.last = 0
+        self.wraps = 0
+        assert f.read(len(MAGIC)) == MAGIC, "Not a sensor trace"
+
+    def read(self):
+        """Return the next (ms, name, payload) record, raises EOFError at the end."""
+        while True:
+            header = self.f.read(_HEADER_SIZE)
+            if len(header) < _HEADER_SIZE:
+                raise EOFError
+            t, channel, size = struct.unpack(_HEADER, header)
+            payload = self.f.read(size)
+            if channel == 0:
+                self.channels[len(self.channels) + 1] = payload.decode()
+                continue
+            # Timestamps wrap after 2**32 ms (~49 days), unwrap them
+            if t < self.last:
+                self.wraps += 1
+            self.last = t
+            return t + (self.wraps << 32), self.channels[channel], payload
+
+
+class RecordingADC:
+    def __init__(self, adc, writer, name):
+        self.adc = adc
+        self.writer = writer
+        self.name = name
+
+    def read(self):
+        value = self.adc.read()
+        self.writer.write(self.name, struct.pack("<H", value))
+        return value
+
+
+class RecordingDS18X20(DS18X20):
+    def __init__(self, onewire, writer, name):
+        super().__init__(onewire)
+        self.writer = writer
+        self.name = name
+
+    def read_scratch(self, rom):
+        try:
+            buf = super().read_scratch(rom)
+        except AssertionError:
+            self.writer.write(self.name, b"\x01" + bytes(rom) + bytes(self.buf))
+            raise
+        self.writer.write(self.name, b"\x00" + bytes(rom) + bytes(buf))
+        return buf
+
+
+def _record_ds(temp_sensor, roms, writer, name):
+    writer.write(name + ".roms", b"".join(bytes(rom) for rom in roms))
+    recording = RecordingDS18X20(temp_sensor.ow, writer, name)
+    recording.power = temp_sensor.power
+    recording.powerpin = temp_sensor.powerpin
+    return recording
+
+
+def record(sensor, writer):
+    """Route a sensor's raw reads through writer.
+
+    Handles TemperatureSensor, MultiBusTemperatureSensor (one "bus<pin>"
+    channel per bus), TurbiditySensor, PhSensor and TDSSensor, raises
+    TypeError for anything else.
+    """
+    known = False
+    if hasattr(sensor, "temp_sensor"):
+        sensor.temp_sensor = _record_ds(sensor.temp_sensor, sensor.roms, writer, "temp_sensor")
+        known = True
+    if hasattr(sensor, "buses"):
+        sensor.buses = [(pin, _record_ds(temp_sensor, roms, writer, f"bus{pin}"), roms) for pin, temp_sensor, roms in sensor.buses]
+        known = True
+    for attr in _ADC_ATTRS:
+        if hasattr(sensor, attr):
+            setattr(sensor, attr, RecordingADC(getattr(sensor, attr), writer, attr))
+            known = True
+    if not known:
+        raise TypeError(f"Cannot record {type(sensor).__name__}")
+
+
+class VirtualClock:
+    """Stands in for the time module. sleep() only advances the clock,
+    divided by speed in real time when a speed is given."""
+    def __init__(self, speed=None):
+        self.speed = speed
+        self.now = 0
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def advance_to(self, ms):
+        self.now = max(self.now, ms)
+
+    def sleep(self, seconds):
+        self.sleep_ms(int(seconds * 1000))
+
+    def sleep_ms(self, ms):
+        self.now += ms
+        if self.speed:
+            time.sleep_ms(int(ms / self.speed))
+
+
+class TraceFeed:
+    """Hands out trace records in order, keeping the clock at or past each record's time."""
+    def __init__(self, reader, clock):
+        self.reader = reader
+        self.clock = clock
+
+    def next(self, name):
+        t, got, payload = self.reader.read()
+        if got != name:
+            raise TraceMismatch(f"Trace out of order: expected {name}, got {got}")
+        self.clock.advance_to(t)
+        return payload
+
+
+class ReplayADC:
+    def __init__(self, feed, name):
+        self.feed = feed
+        self.name = name
+
+    def read(self):
+        return struct.unpack("<H", self.feed.next(self.name))[0]
+
+
+class ReplayDS18X20(DS18X20):
+    def __init__(self, feed, name):
+        super().__init__(None)
+        self.feed = feed
+        self.name = name
+
+    def scan(self):
+        roms = self.feed.next(self.name + ".roms")
+        return [roms[i:i + 8] for i in range(0, len(roms), 8)]
+
+    def convert_temp(self, rom=None):
+        pass
+
+    def read_scratch(self, rom):
+        payload = self.feed.next(self.name)
+        if payload[1:9] != bytes(rom):
+            raise TraceMismatch(f"Trace ROM mismatch on {self.name}")
+        self.buf[:] = payload[9:]
+        # Fail like the recorded read did, read_temp() turns this into None
+        assert payload[0] == 0, 'CRC error'
+        return self.buf
+
+
+def replay_sensor(sensor, feed):
+    """Counterpart of record(), swaps a sensor's hardware for the trace feed."""
+    known = False
+    if hasattr(sensor, "temp_sensor"):
+        sensor.temp_sensor = ReplayDS18X20(feed, "temp_sensor")
+        sensor.roms = sensor.temp_sensor.scan()
+        known = True
+    if hasattr(sensor, "buses"):
+        buses = []
+        for pin, _, _ in sensor.buses:
+            temp_sensor = ReplayDS18X20(feed, f"bus{pin}")
+            buses.append((pin, temp_sensor, temp_sensor.scan()))
+        sensor.buses = buses
+        known = True
+    for attr in _ADC_ATTRS:
+        if hasattr(sensor, attr):
+            setattr(sensor, attr, ReplayADC(feed, attr))
+            known = True
+    if not known:
+        raise TypeError(f"Cannot replay {type(sensor).__name__}")
+
+
+class ReplayMQTT:
+    """MQTTClient stand-in that counts publishes, optionally writing them to out."""
+    def __init__(self, out=None):
+        self.out = out
+        self.published = 0
+        self.bytes = 0
+
+    def check_msg(self):
+        return None
+
+    def publish(self, topic, msg, retain=False, qos=0, properties=None):
+        self.published += 1
+        self.bytes += len(msg)
+        if self.out:
+            self.out.write(msg)
+            self.out.write("\n")
+
+
+def replay(path, handler, speed=None, out=None):
+    """Run handler.step() over the trace at path until it is exhausted.
+
+    The sensors must have been passed to record() in the order temperature,
+    turbidity, pH, TDS, which is the order they are replayed in.
+    Returns the ReplayMQTT sink, whose counts (and out, if given) can be
+    compared between pipeline versions.
+    """
+    clock = VirtualClock(speed)
+    sink = ReplayMQTT(out)
+    real_time = main.time
+    with open(path, "rb") as f:
+        feed = TraceFeed(TraceReader(f), clock)
+        for sensor in (handler.temp_sensor, handler.turbidity_sensor, handler.ph_sensor, handler.tds_sensor):
+            if sensor is not None:
+                replay_sensor(sensor, feed)
+        handler.mqtt = sink
+        main.time = clock
+        try:
+            while True:
+                clock.sleep(handler.step())
+        except EOFError:
+            pass
+        finally:
+            main.time = real_time
+    return sink
@@ -7,6 +7,130 @@ class MQTTException(Exception):
     pass
 
 
+# MQTT 5 property identifiers used by the client
+PROP_PAYLOAD_FORMAT = 0x01
+PROP_MESSAGE_EXPIRY = 0x02
+PROP_CONTENT_TYPE = 0x03
+PROP_SESSION_EXPIRY = 0x11
+PROP_ASSIGNED_CLIENT_ID = 0x12
+PROP_SERVER_KEEPALIVE = 0x13
+PROP_REASON_STRING = 0x1F
+PROP_RECEIVE_MAXIMUM = 0x21
+PROP_TOPIC_ALIAS_MAXIMUM = 0x22
+PROP_TOPIC_ALIAS = 0x23
+PROP_MAXIMUM_QOS = 0x24
+PROP_USER_PROPERTY = 0x26
+
+# Wire type of every MQTT 5 property: B/H/I are 1/2/4 byte integers,
+# v is a variable byte integer, s a UTF-8 string, b binary data and
+# p a user property (string pair, may repeat).
+_PROP_TYPES = {
+    0x01: "B",
+    0x02: "I",
+    0x03: "s",
+    0x08: "s",
+    0x09: "b",
+    0x0B: "v",
+    0x11: "I",
+    0x12: "s",
+    0x13: "H",
+    0x15: "s",
+    0x16: "b",
+    0x17: "B",
+    0x18: "I",
+    0x19: "B",
+    0x1A: "s",
+    0x1C: "s",
+    0x1F: "s",
+    0x21: "H",
+    0x22: "H",
+    0x23: "H",
+    0x24: "B",
+    0x25: "B",
+    0x26: "p",
+    0x27: "I",
+    0x28: "B",
+    0x29: "B",
+    0x2A: "B",
+}
+
+
+def _enc_varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return out
+
+
+def _dec_varint(buf, i):
+    n = 0
+    sh = 0
+    while 1:
+        b = buf[i]
+        i += 1
+        n |= (b & 0x7F) << sh
+        if not b & 0x80:
+            return n, i
+        sh += 7
+
+
+def _enc_str(s):
+    if isinstance(s, str):
+        s = s.encode()
+    return struct.pack("!H", len(s)) + s
+
+
+def _dec_str(buf, i):
+    n = buf[i] << 8 | buf[i + 1]
+    return bytes(buf[i + 2 : i + 2 + n]), i + 2 + n
+
+
+def _enc_props(props):
+    out = bytearray()
+    if props:
+        for pid, val in props.items():
+            t = _PROP_TYPES[pid]
+            if t == "p":
+                for k, v in val if isinstance(val, list) else [val]:
+                    out.append(pid)
+                    out += _enc_str(k) + _enc_str(v)
+                continue
+            out.append(pid)
+            if t == "v":
+                out += _enc_varint(val)
+            elif t in "sb":
+                out += _enc_str(val)
+            else:
+                out += struct.pack("!" + t, val)
+    return _enc_varint(len(out)) + out
+
+
+def _dec_props(buf, i):
+    n, i = _dec_varint(buf, i)
+    end = i + n
+    props = {}
+    while i < end:
+        pid = buf[i]
+        t = _PROP_TYPES[pid]
+        i += 1
+        if t == "p":
+            k, i = _dec_str(buf, i)
+            v, i = _dec_str(buf, i)
+            props.setdefault(pid, []).append((k, v))
+            continue
+        if t == "v":
+            val, i = _dec_varint(buf, i)
+        elif t in "sb":
+            val, i = _dec_str(buf, i)
+        else:
+            val = struct.unpack_from("!" + t, buf, i)[0]
+            i += struct.calcsize(t)
+        props[pid] = val
+    return props, end
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -18,6 +142,8 @@ class MQTTClient:
         keepalive=0,
         ssl=False,
         ssl_params={},
+        protocol=4,
+        properties=None,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -36,6 +162,18 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # MQTT 5 state, only used when protocol == 5
+        assert protocol in (4, 5)
+        self.protocol = protocol
+        self.conn_props = properties
+        self.connack_props = {}
+        self.msg_props = {}
+        self.recv_max = 65535
+        self.topic_alias_max = 0
+        self.max_qos = 2
+        self._aliases = {}
+        self._rx_aliases = {}
+        self._inflight = set()
 
     def _send_str(self, s):
         self.sock.write(struct.pack("!H", len(s)))
@@ -70,6 +208,8 @@ class MQTTClient:
             import ssl
 
             self.sock = ssl.wrap_socket(self.sock, **self.ssl_params)
+        if self.protocol == 5:
+            return self._connect5(clean_session)
         premsg = bytearray(b"\x10\0\0\0\0\0")
         msg = bytearray(b"\x04MQTT\x04\x02\0\0")
 
@@ -110,6 +250,53 @@ class MQTTClient:
             raise MQTTException(resp[3])
         return resp[2] & 1
 
+    def _connect5(self, clean_session):
+        msg = bytearray(b"\0\x04MQTT\x05\0\0\0")
+        msg[7] = clean_session << 1
+        if self.user:
+            msg[7] |= 0xC0
+        if self.keepalive:
+            assert self.keepalive < 65536
+            msg[8] = self.keepalive >> 8
+            msg[9] = self.keepalive & 0x00FF
+        if self.lw_topic:
+            msg[7] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            msg[7] |= self.lw_retain << 5
+        msg += _enc_props(self.conn_props)
+        msg += _enc_str(self.client_id)
+        if self.lw_topic:
+            msg += _enc_props(None)
+            msg += _enc_str(self.lw_topic)
+            msg += _enc_str(self.lw_msg)
+        if self.user:
+            msg += _enc_str(self.user)
+            msg += _enc_str(self.pswd)
+        self.sock.write(b"\x10" + _enc_varint(len(msg)))
+        self.sock.write(msg)
+
+        resp = self.sock.read(1)
+        assert resp == b"\x20"
+        resp = self.sock.read(self._recv_len())
+        # Properties are only present in an MQTT 5 CONNACK. A broker without
+        # MQTT 5 replies with a 2 byte 3.1.1 CONNACK, usually return code 1
+        # (unacceptable protocol version).
+        props = _dec_props(resp, 2)[0] if len(resp) > 2 else {}
+        self.connack_props = props
+        if resp[1] >= 0x80 or len(resp) <= 2:
+            raise MQTTException(resp[1] or 0x84)
+        self.recv_max = props.get(PROP_RECEIVE_MAXIMUM, 65535)
+        self.topic_alias_max = props.get(PROP_TOPIC_ALIAS_MAXIMUM, 0)
+        self.max_qos = props.get(PROP_MAXIMUM_QOS, 2)
+        if PROP_SERVER_KEEPALIVE in props:
+            self.keepalive = props[PROP_SERVER_KEEPALIVE]
+        if PROP_ASSIGNED_CLIENT_ID in props:
+            self.client_id = props[PROP_ASSIGNED_CLIENT_ID]
+        # Topic aliases and in-flight packet ids only live for one connection
+        self._aliases = {}
+        self._rx_aliases = {}
+        self._inflight = set()
+        return resp[0] & 1
+
     def disconnect(self):
         self.sock.write(b"\xe0\0")
         self.sock.close()
@@ -117,7 +304,9 @@ class MQTTClient:
     def ping(self):
         self.sock.write(b"\xc0\0")
 
-    def publish(self, topic, msg, retain=False, qos=0):
+    def publish(self, topic, msg, retain=False, qos=0, properties=None):
+        if self.protocol == 5:
+            return self._publish5(topic, msg, retain, qos, properties)
         pkt = bytearray(b"\x30\0\0\0")
         pkt[0] |= qos << 1 | retain
         sz = 2 + len(topic) + len(msg)
@@ -152,8 +341,49 @@ class MQTTClient:
         elif qos == 2:
             assert 0
 
+    # MQTT 5 publish. The topic string is sent only the first time it is
+    # used while the broker grants topic aliases, afterwards the two byte
+    # alias replaces it. QoS 1 messages are not waited for individually,
+    # up to the broker's Receive Maximum may be unacknowledged at once.
+    def _publish5(self, topic, msg, retain, qos, properties):
+        assert qos <= self.max_qos
+        props = dict(properties) if properties else {}
+        alias = self._aliases.get(topic)
+        if alias:
+            props[PROP_TOPIC_ALIAS] = alias
+            body = bytearray(b"\0\0")
+        else:
+            if len(self._aliases) < self.topic_alias_max:
+                alias = len(self._aliases) + 1
+                self._aliases[topic] = alias
+                props[PROP_TOPIC_ALIAS] = alias
+            body = _enc_str(topic)
+        if qos > 0:
+            while len(self._inflight) >= self.recv_max:
+                self.wait_msg()
+            self.pid = self.pid % 0xFFFF + 1
+            body += struct.pack("!H", self.pid)
+            self._inflight.add(self.pid)
+        body += _enc_props(props)
+        if isinstance(msg, str):
+            msg = msg.encode()
+        sz = len(body) + len(msg)
+        assert sz < 2097152
+        self.sock.write(bytes([0x30 | qos << 1 | retain]) + _enc_varint(sz))
+        self.sock.write(body)
+        self.sock.write(msg)
+        if qos == 2:
+            assert 0
+
+    # Block until every QoS 1 message published in MQTT 5 mode is acknowledged.
+    def flush(self):
+        while self._inflight:
+            self.wait_msg()
+
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
+        if self.protocol == 5:
+            return self._subscribe5(topic, qos)
         pkt = bytearray(b"\x82\0\0\0")
         self.pid += 1
         struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
@@ -171,6 +401,24 @@ class MQTTClient:
                     raise MQTTException(resp[3])
                 return
 
+    def _subscribe5(self, topic, qos):
+        self.pid = self.pid % 0xFFFF + 1
+        pid = self.pid
+        body = struct.pack("!H", pid) + _enc_props(None) + _enc_str(topic)
+        body += bytes([qos])
+        self.sock.write(b"\x82" + _enc_varint(len(body)))
+        self.sock.write(body)
+        while 1:
+            op = self.wait_msg()
+            if op == 0x90:
+                resp = self.sock.read(self._recv_len())
+                if resp[0] << 8 | resp[1] != pid:
+                    continue
+                _, i = _dec_props(resp, 2)
+                if resp[i] >= 0x80:
+                    raise MQTTException(resp[i])
+                return
+
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
@@ -187,6 +435,8 @@ class MQTTClient:
             assert sz == 0
             return None
         op = res[0]
+        if self.protocol == 5 and op in (0x40, 0xE0):
+            return self._ack5(op)
         if op & 0xF0 != 0x30:
             return op
         sz = self._recv_len()
@@ -198,6 +448,17 @@ class MQTTClient:
             pid = self.sock.read(2)
             pid = pid[0] << 8 | pid[1]
             sz -= 2
+        if self.protocol == 5:
+            props_len = self._recv_len()
+            props = self.sock.read(props_len)
+            sz -= len(_enc_varint(props_len)) + props_len
+            self.msg_props, _ = _dec_props(_enc_varint(props_len) + props, 0)
+            alias = self.msg_props.get(PROP_TOPIC_ALIAS)
+            if alias:
+                if topic:
+                    self._rx_aliases[alias] = topic
+                else:
+                    topic = self._rx_aliases[alias]
         msg = self.sock.read(sz)
         self.cb(topic, msg)
         if op & 6 == 2:
@@ -208,6 +469,19 @@ class MQTTClient:
             assert 0
         return op
 
+    # Handle an MQTT 5 PUBACK or server-sent DISCONNECT, raising on
+    # error reason codes.
+    def _ack5(self, op):
+        sz = self._recv_len()
+        resp = self.sock.read(sz) if sz else b""
+        if op == 0xE0:
+            self.sock.close()
+            raise MQTTException(resp[0] if resp else 0)
+        self._inflight.discard(resp[0] << 8 | resp[1])
+        if sz > 2 and resp[2] >= 0x80:
+            raise MQTTException(resp[2])
+        return op
+
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.